@@ -6,6 +6,16 @@ import tempfile
 import shutil
 import subprocess
 
+_TEST_FILE_RE = re.compile(
+    r'<TEST_FILE filename="([^"]+)">(.*?)</TEST_FILE>', re.DOTALL
+)
+# Maven reports the goal that broke the build as
+# "Failed to execute goal <groupId>:<artifactId>:<version>:<goal> ...".
+_FAILED_GOAL_RE = re.compile(
+    r"Failed to execute goal [\w.-]+:([\w.-]+):[\w.-]+:([\w-]+)"
+)
+_FAST_STARTUP_MAVEN_OPTS = "-XX:+TieredCompilation -XX:TieredStopAtLevel=1"
+
 
 @dataclass
 class GradingResult:
@@ -34,13 +44,9 @@ def get_assert(output: str, context) -> Union[bool, float, GradingResult]:
     temp_dir = create_temp_dir(prototype_dir)
     test_cases = parse_test_cases(output)
     write_test_cases(temp_dir, test_cases)
-    install_ok, install_out = exec_command(
-        temp_dir, ["mvn", "install", "-DskipTests=true", "-Dmaven.compile.skip=true"]
-    )
-    compile_ok, compile_out = (
-        exec_command(temp_dir, ["mvn", "test-compile"]) if install_ok else False
+    (install_ok, install_out), (compile_ok, compile_out), (test_ok, test_out) = (
+        exec_maven_test(temp_dir)
     )
-    test_ok, test_out = exec_command(temp_dir, ["mvn", "test"]) if compile_ok else False
     mutation_ok, mutation_out = (
         exec_command(
             temp_dir,
@@ -74,6 +80,30 @@ def get_assert(output: str, context) -> Union[bool, float, GradingResult]:
         ],
     }
 
+def exec_maven_test(temp_dir: str) -> List[Tuple[bool, str]]:
+    """Run install, test-compile and test in a single Maven invocation.
+
+    Returns the (ok, output) results for each of the three phases, working
+    out which phase broke the build from the goal Maven reports as failed.
+    """
+    # Run the generated test classes in one reused Surefire fork per core.
+    ok, out = exec_command(
+        temp_dir,
+        ["mvn", "--batch-mode", "test", "-DforkCount=1C", "-DreuseForks=true"],
+    )
+    if ok:
+        return [(True, ""), (True, ""), (True, "")]
+    match = _FAILED_GOAL_RE.search(out)
+    failed_goal = match.groups() if match else None
+    if failed_goal == ("maven-surefire-plugin", "test"):
+        return [(True, ""), (True, ""), (False, out)]
+    if failed_goal == ("maven-compiler-plugin", "testCompile"):
+        return [(True, ""), (False, out), (False, "")]
+    # Anything earlier, including compiling the main sources, used to fail
+    # the install step.
+    return [(False, out), (False, ""), (False, "")]
+
+
 def parse_mutation_coverage(temp_dir: str) -> float:
     with open(os.path.join(temp_dir, "target", "pit-reports", "index.html"), "r") as file:
         content = file.read()
@@ -86,12 +116,73 @@ def parse_mutation_coverage(temp_dir: str) -> float:
         return 0.0
 
 
+# Directories (relative to the prototype) that get written to during grading.
+# These are copied, everything else is linked back to the prototype.
+_COPIED_DIRS = {os.path.join("src", "test")}
+# Build output is regenerated by Maven so there is no need to clone it.
+_SKIPPED_DIRS = {"target"}
+
+
 def create_temp_dir(prototype_dir: str) -> str:
     temp_dir = tempfile.mkdtemp()
-    shutil.copytree(prototype_dir, temp_dir, dirs_exist_ok=True)
+    for root, dirs, files in os.walk(prototype_dir):
+        rel_root = os.path.relpath(root, prototype_dir)
+        dest_root = os.path.normpath(os.path.join(temp_dir, rel_root))
+        for dir in list(dirs):
+            rel_dir = os.path.normpath(os.path.join(rel_root, dir))
+            if rel_dir in _SKIPPED_DIRS:
+                dirs.remove(dir)
+            elif rel_dir in _COPIED_DIRS:
+                dirs.remove(dir)
+                shutil.copytree(
+                    os.path.join(root, dir),
+                    os.path.join(dest_root, dir),
+                    copy_function=copy_file,
+                )
+            elif os.path.islink(os.path.join(root, dir)):
+                # os.walk doesn't descend into symlinked directories, so link
+                # to the target rather than leaving an empty directory.
+                os.symlink(
+                    os.path.realpath(os.path.join(root, dir)),
+                    os.path.join(dest_root, dir),
+                )
+            else:
+                os.makedirs(os.path.join(dest_root, dir), exist_ok=True)
+        for file in files:
+            link_file(os.path.join(root, file), os.path.join(dest_root, file))
     return temp_dir
 
 
+def copy_file(src: str, dst: str) -> str:
+    """Copy a file in kernel space, falling back to shutil.copy2."""
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            copied = 0
+            while copied < size:
+                if hasattr(os, "copy_file_range"):
+                    n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+                else:
+                    n = os.sendfile(fdst.fileno(), fsrc.fileno(), copied, size - copied)
+                if n == 0:
+                    # Like shutil's fast-copy path, treat a short copy as
+                    # unsupported and fall back to a regular copy.
+                    raise OSError(f"short copy of {src}: {copied} of {size} bytes")
+                copied += n
+        shutil.copystat(src, dst)
+        return dst
+    except (AttributeError, OSError):
+        return shutil.copy2(src, dst)
+
+
+def link_file(src: str, dst: str) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Hardlinks don't work across filesystems, fall back to a symlink.
+        os.symlink(os.path.abspath(src), dst)
+
+
 class TestCase(TypedDict):
     filename: str
     code: str
@@ -99,8 +190,7 @@ class TestCase(TypedDict):
 
 def parse_test_cases(output: str) -> list[TestCase]:
     test_cases: List[TestCase] = []
-    pattern = r'<TEST_FILE filename="([^"]+)">(.*?)</TEST_FILE>'
-    matches = re.finditer(pattern, output, re.DOTALL)
+    matches = _TEST_FILE_RE.finditer(output)
 
     for match in matches:
         filename = match.group(1)
@@ -117,20 +207,43 @@ def write_test_cases(temp_dir: str, test_cases: List[TestCase]) -> None:
             raise ValueError(test_case)
         filename = test_case["filename"]
         code = test_case["code"]
-        with open(os.path.join(temp_dir, filename), "w") as file:
-            file.write(code)
+        path = os.path.join(temp_dir, filename)
+        if os.path.islink(path) or os.path.isfile(path):
+            # Break any link back to the prototype before overwriting.
+            os.unlink(path)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            data = memoryview(code.encode("utf-8"))
+            while data:
+                data = data[os.write(fd, data) :]
+        finally:
+            os.close(fd)
+
+
+def maven_env() -> Dict[str, str]:
+    # Maven runs are short-lived, so stop the JIT at C1 to cut JVM start-up.
+    maven_opts = os.environ.get("MAVEN_OPTS", "")
+    maven_opts = f"{_FAST_STARTUP_MAVEN_OPTS} {maven_opts}".strip()
+    return {**os.environ, "MAVEN_OPTS": maven_opts}
 
 
 def exec_command(working_dir: str, args: List[str]) -> Tuple[bool, str]:
     try:
         subprocess.run(
-            args, cwd=working_dir, check=True, capture_output=True, text=True
+            args,
+            cwd=working_dir,
+            check=True,
+            capture_output=True,
+            env=maven_env(),
         )
         return (True, "")
     except subprocess.CalledProcessError as e:
+        # The output is only needed on failure, so only decode it here.
+        stdout = e.stdout.decode("utf-8", errors="replace")
+        stderr = e.stderr.decode("utf-8", errors="replace")
         print(f"Error executing command: {' '.join(args)}")
         print(f"Working directory: {working_dir}")
         print(f"Exit code: {e.returncode}")
-        print(f"Stdout: {e.stdout}")
-        print(f"Stderr: {e.stderr}")
-        return (False, e.stdout + e.stderr)
+        print(f"Stdout: {stdout}")
+        print(f"Stderr: {stderr}")
+        return (False, stdout + stderr)
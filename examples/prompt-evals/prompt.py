@@ -1,10 +1,36 @@
+import atexit
+import functools
+import io
 import os
 import json
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional, fall back to the standard library json module.
+    orjson = None
+
+# Append handle for context.json, opened on first use and kept open for the
+# lifetime of the process.
+_CTX_FH = None
+
+def _context_file():
+    global _CTX_FH
+    if _CTX_FH is None:
+        _CTX_FH = open('context.json', 'ab')
+        atexit.register(_CTX_FH.close)
+    return _CTX_FH
+
+def _dump_json(obj) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode('utf-8')
 
 def code_reviewer(context: dict) -> str:
-    with open('context.json', 'a') as f:
-        json.dump(context, f)
-        f.write('\n')
+    f = _context_file()
+    f.write(_dump_json(context) + b'\n')
+    f.flush()
     variables: dict = context['vars']
     instruction = "List all the functions defined in the above files."
     return format_directory(variables['dir'], instruction)
@@ -35,24 +61,65 @@ def generate_java_test(context: dict) -> str:
     return format_directory(dir, instruction)
 
 def format_directory(dir: str, instruction: str) -> str:
-    prompt = []
+    prompt = io.StringIO()
     for file, content in walk_dir(dir):
-        prompt.append(format_context_file(file, content))
-    prompt.append(instruction)
-    return '\n'.join(prompt)
+        prompt.write(format_context_file(file, content))
+        prompt.write('\n')
+    prompt.write(instruction)
+    return prompt.getvalue()
 
 def format_context_file(filename: str, content: str) -> str:
     return f"<CONTEXT_FILE FILE_NAME={filename}>\n{content}\n</CONTEXT_FILE>"
 
+def scan_files(dir: str):
+    # Like os.walk, list a directory's own files before descending into its
+    # subdirectories, but use the type info cached on each DirEntry.
+    subdirs = []
+    try:
+        entries = os.scandir(dir)
+    except OSError:
+        # os.walk silently skips unreadable or missing directories.
+        return
+    with entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.is_file():
+                yield entry
+    for subdir in subdirs:
+        yield from scan_files(subdir)
+
 def walk_dir(dir: str) -> list:
-    file_content_pairs = []
-    for root, _, files in os.walk(dir):
-        for file in files:
-            file_path = os.path.join(root, file)
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            file_content_pairs.append((file, content))
-    return file_content_pairs
+    # The same directory is formatted once per provider in an eval run, so
+    # reuse the result until a file in the tree is added, removed or changed.
+    files = []
+    for entry in scan_files(dir):
+        st = entry.stat()
+        files.append((entry.path, st.st_mtime_ns, st.st_size))
+    return list(_walk_dir_cached(tuple(files)))
+
+@functools.lru_cache(maxsize=128)
+def _walk_dir_cached(files: tuple) -> tuple:
+    file_paths = [file_path for file_path, _, _ in files]
+    # File reads release the GIL, so a thread pool overlaps the I/O latency.
+    max_workers = min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        contents = executor.map(read_file, file_paths)
+        return tuple(
+            (os.path.basename(file_path), content)
+            for file_path, content in zip(file_paths, contents)
+        )
+
+def read_file(file_path: str) -> str:
+    fd = os.open(file_path, os.O_RDONLY)
+    try:
+        data = os.read(fd, os.fstat(fd).st_size)
+        # Only reads anything if the file grew since the fstat.
+        while chunk := os.read(fd, 65536):
+            data += chunk
+    finally:
+        os.close(fd)
+    return data.decode('utf-8')
 
 if __name__ == "__main__":
     with open('context.json', 'r') as f:
@@ -4,11 +4,15 @@ to provide context-aware responses based on repository content.
 """
 
 import argparse
+import hashlib
 import json
 import os
+import sqlite3
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
+from requests.adapters import HTTPAdapter
 
 access_token = os.getenv("SRC_ACCESS_TOKEN")
 if not access_token:
@@ -24,6 +28,67 @@ chat_completions_url = (
 )
 # Headers
 headers = {"Content-Type": "application/json", "Authorization": f"token {access_token}"}
+# Shared session so the TCP/TLS connection is reused across requests
+session = requests.Session()
+session.headers.update(headers)
+adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+session.mount("https://", adapter)
+session.mount("http://", adapter)
+# Repository name -> ID lookups, keyed by the set of names requested
+repo_ids_cache = {}
+context_search_query = """
+query GetCodyContext($repos: [ID!]!, $query: String!, $codeResultsCount: Int!, $textResultsCount: Int!) {
+    getCodyContext(repos: $repos, query: $query, codeResultsCount: $codeResultsCount, textResultsCount: $textResultsCount) {
+        ...on FileChunkContext {
+            blob {
+                path
+                repository {
+                  id
+                  name
+                }
+                commit {
+                  oid
+                }
+                url
+              }
+              startLine
+              endLine
+              chunkContent
+        }
+    }
+}
+"""
+repository_ids_query = """
+query Repositories($names: [String!]!, $first: Int!) {
+    repositories(names: $names, first: $first) {
+        nodes {
+            name
+            id
+        }
+    }
+}
+"""
+# The queries never change, so serialize them once and only encode the
+# variables per request (see graphql_body)
+context_search_body_prefix = json.dumps({"query": context_search_query})[:-1]
+repository_ids_body_prefix = json.dumps({"query": repository_ids_query})[:-1]
+# On-disk cache of chat responses, keyed by the repositories and query
+response_cache_path = os.path.join(
+    os.getenv("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "cody",
+    "responses.sqlite3",
+)
+
+
+def graphql_body(body_prefix, variables):
+    """
+    Build a GraphQL request body from a pre-serialized query.
+
+    :param body_prefix: JSON object holding the query, without its closing brace
+    :param variables: The query variables (dict)
+    :return: The encoded request body (bytes)
+    """
+    return f'{body_prefix}, "variables": {json.dumps(variables)}}}'.encode("utf-8")
 
 
 def format_context(context):
@@ -34,18 +99,14 @@ def format_context(context):
     :return: The formatted context (string)
     """
 
-    context_parts = []
-    context_parts.append("<context>")
-    for result in context:
-        context_parts.append("<item>")
-        context_parts.append(
-            f"<file>{result['blob']['path']}:{result['startLine']}-{result['endLine']}</file>"
-        )
-        context_parts.append(f"<chunk>{result['chunkContent']}</chunk>")
-        context_parts.append("</item>")
-    context_parts.append("</context>")
-
-    formatted_context = "\n".join(context_parts)
+    items = "".join(
+        f"<item>\n"
+        f"<file>{result['blob']['path']}:{result['startLine']}-{result['endLine']}</file>\n"
+        f"<chunk>{result['chunkContent']}</chunk>\n"
+        f"</item>\n"
+        for result in context
+    )
+    formatted_context = f"<context>\n{items}</context>"
 
     return formatted_context
 
@@ -58,33 +119,14 @@ def get_repo_context(repo_names, query, code_results_count=10, text_results_coun
     :param query: Search query string
     :param code_results_count: Number of code results to return (default: 10)
     :param text_results_count: Number of text results to return (default: 5)
-    :return: JSON response containing the repository context
-    """
-    context_search_query = """
-    query GetCodyContext($repos: [ID!]!, $query: String!, $codeResultsCount: Int!, $textResultsCount: Int!) {
-        getCodyContext(repos: $repos, query: $query, codeResultsCount: $codeResultsCount, textResultsCount: $textResultsCount) {
-            ...on FileChunkContext {
-                blob {
-                    path
-                    repository {
-                      id
-                      name
-                    }
-                    commit {
-                      oid
-                    }
-                    url
-                  }
-                  startLine
-                  endLine
-                  chunkContent
-            }
-        }
-    }
+    :return: JSON response containing the repository context, or None if the
+        lookup failed
     """
     if not repo_names:
         return ""
     repo_ids = get_repo_ids(repo_names)
+    if not repo_ids:
+        return None
 
     variables = {
         "repos": list(repo_ids.values()),
@@ -93,10 +135,9 @@ def get_repo_context(repo_names, query, code_results_count=10, text_results_coun
         "textResultsCount": text_results_count,
     }
 
-    response = requests.post(
+    response = session.post(
         graphql_url,
-        json={"query": context_search_query, "variables": variables},
-        headers=headers,
+        data=graphql_body(context_search_body_prefix, variables),
         timeout=30,
     )
 
@@ -111,44 +152,43 @@ def get_repo_ids(repo_names):
     """
     Convert repository names to their corresponding IDs using a GraphQL query.
 
+    Results are cached for the lifetime of the process, so repeated lookups
+    of the same set of repositories don't hit the API again.
+
     :param repo_names: List of repository names
     :return: Dictionary mapping repository names to their IDs
     """
-    repository_ids_query = """
-    query Repositories($names: [String!]!, $first: Int!) {
-        repositories(names: $names, first: $first) {
-            nodes {
-                name
-                id
-            }
-        }
-    }
-    """
+    cache_key = frozenset(repo_names)
+    if cache_key in repo_ids_cache:
+        return dict(repo_ids_cache[cache_key])
 
     variables = {"names": repo_names, "first": len(repo_names)}
 
-    response = requests.post(
+    response = session.post(
         graphql_url,
-        json={"query": repository_ids_query, "variables": variables},
-        headers=headers,
+        data=graphql_body(repository_ids_body_prefix, variables),
         timeout=30,
     )
 
     if response.status_code == 200:
         data = response.json()
-        return {
+        repo_ids = {
             node["name"]: node["id"] for node in data["data"]["repositories"]["nodes"]
         }
+        repo_ids_cache[cache_key] = repo_ids
+        return dict(repo_ids)
 
     print(f"Failed to fetch repository IDs. Status code: {response.status_code}")
     return {}
 
 
-def chat_completions(query):
+def chat_completions(query, stream_to=None):
     """
     Send a chat completion request to the Sourcegraph API and process the SSE stream.
 
     :param query: The user's query (string)
+    :param stream_to: Optional file-like object that the completion is written
+        to as it arrives (default: None)
     :return: The last completion response (string)
     """
     data = {
@@ -162,8 +202,8 @@ def chat_completions(query):
     }
 
     try:
-        response = requests.post(
-            chat_completions_url, headers=headers, json=data, stream=True, timeout=30
+        response = session.post(
+            chat_completions_url, json=data, stream=True, timeout=30
         )
         response.raise_for_status()
 
@@ -172,9 +212,17 @@ def chat_completions(query):
         # event with which is followed by a "done" event with empty data.
         # Practically this is the last line starting with r'^data: {"'
         last_response = ""
+        streamed = ""
         for line in response.iter_lines(decode_unicode=True):
             if line.startswith('data: {"'):
                 last_response = line[6:]
+                if stream_to is not None:
+                    # Each event carries the full completion so far, so
+                    # only write the part that hasn't been written yet.
+                    completion = json.loads(last_response).get("completion", "")
+                    stream_to.write(completion[len(streamed) :])
+                    stream_to.flush()
+                    streamed = completion
         # last_response should look like:
         # '{"completion": "... some answer ...", "stopReason": "stop"}'
         return json.loads(last_response)["completion"]
@@ -187,13 +235,127 @@ def chat_completions(query):
         return None
 
 
-def cody_chat(repo_names, query):
+def response_cache_key(repo_names, query):
+    """
+    Build the response cache key for the given repositories and query.
+
+    :param repo_names: List of repository names (strings)
+    :param query: Natural language query (string)
+    :return: Hex digest identifying the (repositories, query) pair (string)
+    """
+    key = json.dumps(sorted(repo_names)) + query
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def open_response_cache():
+    """
+    Open the response cache database, creating it if it doesn't exist yet.
+
+    :return: sqlite3 connection to the response cache
+    """
+    os.makedirs(os.path.dirname(response_cache_path), exist_ok=True)
+    connection = sqlite3.connect(response_cache_path)
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT)"
+    )
+    return connection
+
+
+def get_cached_response(key):
+    """
+    Look up a previously cached chat response.
+
+    :param key: Cache key from response_cache_key
+    :return: The cached response (string), or None if there is none
+    """
+    connection = open_response_cache()
+    try:
+        row = connection.execute(
+            "SELECT response FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+    finally:
+        connection.close()
+    return json.loads(row[0]) if row else None
+
+
+def cache_response(key, response):
+    """
+    Store a chat response in the response cache.
+
+    :param key: Cache key from response_cache_key
+    :param response: The chat response to cache (string)
+    """
+    connection = open_response_cache()
+    try:
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response) VALUES (?, ?)",
+                (key, json.dumps(response)),
+            )
+    finally:
+        connection.close()
+
+
+def cody_chat(repo_names, query, use_cache=True):
     """
     Get context for the given repositories and query, then print it out.
 
     :param repo_names: List of repository names (strings)
     :param query: Natural language query (string)
+    :param use_cache: Whether to use the on-disk response cache (default: True)
+    """
+    answer_query(repo_names, query, stream_to=sys.stdout, use_cache=use_cache)
+    # The response has already been streamed out, terminate its line.
+    print()
+
+
+def cody_chat_batch(repo_names, queries, max_workers=8, use_cache=True):
+    """
+    Answer several queries against the same repositories concurrently, then
+    print the responses in the order the queries were given.
+
+    The requests are I/O-bound, so running them on a thread pool over the
+    shared session overlaps the server latency of the individual queries.
+
+    :param repo_names: List of repository names (strings)
+    :param queries: List of natural language queries (strings)
+    :param max_workers: Maximum number of queries in flight (default: 8)
+    :param use_cache: Whether to use the on-disk response cache (default: True)
+    """
+    if repo_names:
+        # Resolve the repository IDs once up front so the queries share the
+        # cached lookup instead of racing to fetch it.
+        get_repo_ids(repo_names)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        responses = executor.map(
+            lambda query: answer_query(repo_names, query, use_cache=use_cache),
+            queries,
+        )
+        for response in responses:
+            print(response)
+
+
+def answer_query(repo_names, query, stream_to=None, use_cache=True):
+    """
+    Get context for the given repositories and query, then ask Cody to answer
+    the query based on it.
+
+    :param repo_names: List of repository names (strings)
+    :param query: Natural language query (string)
+    :param stream_to: Optional file-like object that the completion is written
+        to as it arrives (default: None)
+    :param use_cache: Whether to use the on-disk response cache (default: True)
+    :return: The completion response (string)
     """
+    cache_key = response_cache_key(repo_names, query)
+    if use_cache:
+        cached_response = get_cached_response(cache_key)
+        if cached_response is not None:
+            if stream_to is not None:
+                stream_to.write(cached_response)
+            return cached_response
+
     context = get_repo_context(
         repo_names=repo_names,
         query=query,
@@ -207,8 +369,12 @@ def cody_chat(repo_names, query):
     You need to answer the query based on the context.
     """
 
-    response = chat_completions(final_prompt)
-    print(response)
+    response = chat_completions(final_prompt, stream_to=stream_to)
+    # Don't cache answers given without the context, so the next run retries
+    # the lookup instead of serving a degraded response forever.
+    if use_cache and response is not None and context is not None:
+        cache_response(cache_key, response)
+    return response
 
 
 def main():
@@ -221,7 +387,16 @@ def main():
         action="append",
         help="Repository name (can be used multiple times) [Optional]",
     )
-    parser.add_argument("--message", type=str, help="Query message")
+    parser.add_argument(
+        "--message",
+        action="append",
+        help="Query message (can be used multiple times to run queries concurrently)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't read or write the on-disk response cache [Optional]",
+    )
 
     if len(sys.argv) == 1:
         parser.print_help(sys.stderr)
@@ -233,8 +408,11 @@ def main():
         raise ValueError("Error: --message argument is required.")
 
     repo_names = args.context_repo or []
-    query = args.message
-    cody_chat(repo_names, query)
+    use_cache = not args.no_cache
+    if len(args.message) == 1:
+        cody_chat(repo_names, args.message[0], use_cache=use_cache)
+    else:
+        cody_chat_batch(repo_names, args.message, use_cache=use_cache)
 
 
 if __name__ == "__main__":
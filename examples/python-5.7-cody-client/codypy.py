@@ -41,9 +41,9 @@ Usage:
     response = client.chat("Hello, Cody!")
 
     # Asynchronous usage
-    async_client = AsyncCodyAPIClient()
-    models = await async_client.get_models()
-    response = await async_client.chat("Hello, Cody!")
+    async with AsyncCodyAPIClient() as async_client:
+        models = await async_client.get_models()
+        response = await async_client.chat("Hello, Cody!")
 
 Note:
     This module requires the following environment variables to be set:
@@ -59,12 +59,22 @@ Examples:
 import asyncio
 import logging
 import os
+import time
+from types import MappingProxyType
 from typing import Literal, TypeAlias
 
-import aiohttp
+import httpx
 import pydantic_core as pd
 import requests
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
+from requests.adapters import HTTPAdapter
+from tenacity import (
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
+from urllib3.util.retry import Retry
 
 
 LLMModels: TypeAlias = Literal[
@@ -83,34 +93,108 @@ LLMModels: TypeAlias = Literal[
     "openai::2024-02-01::gpt-3.5-turbo",
 ]
 DEFAULT_LLM = "anthropic::2023-06-01::claude-3.5-sonnet"
+# Rate limited and transient server errors, which are retried with backoff
+_RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    """Whether an async request failed with a transient error worth retrying"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in _RETRY_STATUSES
+    return isinstance(exc, (httpx.TransportError, asyncio.TimeoutError))
+
+
+def _last_sse_data(body: bytes) -> bytes:
+    """Return the JSON payload of the last 'data: {' line of a server-sent
+    events body, using a single reverse scan instead of splitting it into
+    lines"""
+    _, sep, tail = body.rpartition(b'\ndata: {"')
+    if not sep:
+        if not body.startswith(b'data: {"'):
+            return b""
+        tail = body[len(b'data: {"') :]
+    return b'{"' + tail.split(b"\n", 1)[0].rstrip(b"\r")
+
+
+def _extract_stream_completion(body: bytes) -> str:
+    """Return the final completion from a streaming completions response
+
+    The completions streaming API returns data in server-sent events
+    format. We only need to capture the last "completion" event which is
+    followed by a "done" event with empty data. Practically this is the
+    last line starting with r'^data: {"', which should look like:
+    '{"completion": "... some answer ...", "stopReason": "stop"}'
+    """
+    data = pd.from_json(_last_sse_data(body))
+    if "completion" not in data:
+        raise ValueError("Received unexpected API response")
+    return data["completion"]
 
 
 class Message(BaseModel):
     """OpenAPI message model"""
 
+    model_config = ConfigDict(frozen=True, extra="forbid")
+
     content: str | list[dict[str, str]]
     role: Literal["user", "assistant"] = "user"
 
 
-class CodyAPIClient:
-    """Cody API Client
-
-    Usage:
-    >>> from codypy import CodyAPIClient
-    # If you have SRC_ACCESS_TOKEN and SRC_ENDPOINT set as envvar
-    >>> client = CodyAPIClient()
-    # Alternatively passing token and endpoint directly
-    >>> client = CodyAPIClient(access_token, server_endpoint)
-    # Get available models
-    >>> models = client.get_models()
-    >>> print("Available models:", models)
-    # Send a chat message
-    >>> response = client.chat("What is the capital of France?")
-    >>> print("Chat response:", response['choices'][0]['message']['content'])
-    # Send a streaming chat message
-    >>> stream_response = client.chat_stream("Tell me a joke")
-    >>> print("Streaming response:", stream_response)
-    """
+def _build_chat_payload(
+    message: str | list[Message | dict], model: str, max_completion_tokens: int
+) -> bytes:
+    """Build the encoded request body for the non-streaming LLM API"""
+    # Plain dicts serialize the same as Message models but skip pydantic
+    # validation, which dominates the cost for small payloads
+    if isinstance(message, str):
+        messages = [{"role": "user", "content": message}]
+    else:
+        messages = [m.model_dump() if isinstance(m, Message) else m for m in message]
+    payload = {
+        "model": model,
+        "messages": messages,
+        "stream": False,
+        "max_tokens": max_completion_tokens,
+    }
+    return pd.to_json(payload)
+
+
+def _build_stream_payload(query: str, model: str, max_completion_tokens: int) -> dict:
+    """Build the request body for the streaming LLM API"""
+    return {
+        "model": model,
+        "messages": [{"speaker": "human", "text": query}],
+        "maxTokensToSample": max_completion_tokens,
+    }
+
+
+def _build_context_payload(
+    repos: str | list[str],
+    query: str,
+    code_results_count: int,
+    text_results_count: int,
+) -> dict:
+    """Build the request body for the context API"""
+    if isinstance(repos, str):
+        repos = [{"name": repos}]
+    else:
+        repos = [{"name": x} for x in repos]
+    return {
+        "repos": repos,
+        "query": query,
+        "codeResultsCount": code_results_count,
+        "textResultsCount": text_results_count,
+    }
+
+
+# Streaming completions API path, with its fixed query string pre-encoded
+_COMPLETIONS_STREAM_URI = (
+    "/.api/completions/stream?api-version=1&client-name=codypy&client-version=5.7"
+)
+
+
+class _BaseCodyAPIClient:
+    """Configuration and state shared by the sync and async clients"""
 
     def __init__(self, access_token: str = "", server_endpoint: str = ""):
         self.access_token = access_token or os.getenv("SRC_ACCESS_TOKEN")
@@ -125,8 +209,7 @@ class CodyAPIClient:
                 "You must either pass 'server_endpoint' explicitly "
                 "or set 'SRC_ENDPOINT' environment variable."
             )
-        self.session = requests.Session()
-        self.session.headers.update(
+        self.headers = MappingProxyType(
             {
                 "Authorization": f"token {self.access_token}",
                 "Content-Type": "application/json",
@@ -135,61 +218,110 @@ class CodyAPIClient:
             }
         )
         self.logger = logging.getLogger(__name__)
+        # Model catalog from get_models() and when it was fetched
+        self._models_cache: list | None = None
+        self._models_cache_ts = 0.0
+
+    def _cached_models(self, ttl: float) -> list | None:
+        """Return a copy of the cached model list, unless it is older than
+        `ttl`, so callers can't mutate the cache"""
+        if (
+            self._models_cache is not None
+            and time.monotonic() - self._models_cache_ts < ttl
+        ):
+            return list(self._models_cache)
+        return None
+
+    def _cache_models(self, models: list) -> list:
+        self._models_cache = models
+        self._models_cache_ts = time.monotonic()
+        return list(models)
+
+    def _log_failed_response(self, method: str, url: str, resp):
+        """Log an error response, works for both requests and httpx responses"""
+        self.logger.error(
+            "API %s %s failed: %s %s",
+            method.upper(),
+            url,
+            resp.status_code,
+            resp.text[:500],
+        )
+
+
+class CodyAPIClient(_BaseCodyAPIClient):
+    """Cody API Client
+
+    Usage:
+    >>> from codypy import CodyAPIClient
+    # If you have SRC_ACCESS_TOKEN and SRC_ENDPOINT set as envvar
+    >>> client = CodyAPIClient()
+    # Alternatively passing token and endpoint directly
+    >>> client = CodyAPIClient(access_token, server_endpoint)
+    # Get available models
+    >>> models = client.get_models()
+    >>> print("Available models:", models)
+    # Send a chat message
+    >>> response = client.chat("What is the capital of France?")
+    >>> print("Chat response:", response['choices'][0]['message']['content'])
+    # Send a streaming chat message
+    >>> stream_response = client.chat_stream("Tell me a joke")
+    >>> print("Streaming response:", stream_response)
+    """
+
+    def __init__(self, access_token: str = "", server_endpoint: str = ""):
+        super().__init__(access_token, server_endpoint)
+        self.session = requests.Session()
+        self.session.headers.update(self.headers)
+        adapter = HTTPAdapter(
+            pool_connections=20,
+            pool_maxsize=100,
+            max_retries=Retry(
+                total=5,
+                backoff_factor=0.5,
+                status_forcelist=_RETRY_STATUSES,
+                allowed_methods=frozenset(["GET", "POST"]),
+                # Hand the last response back so it's logged and raised as
+                # an HTTPError rather than a RetryError
+                raise_on_status=False,
+            ),
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
 
     def _make_request(self, method: str, uri: str, timeout: int = 10, **kwargs):
         """Make a generic request via the session"""
-        url = self.server_endpoint + uri
-
+        url = f"{self.server_endpoint}{uri}"
+        stream = kwargs.pop("stream", None)
         resp = self.session.request(method, url, timeout=timeout, **kwargs)
-        try:
+        if not resp.ok:
+            self._log_failed_response(method, url, resp)
             resp.raise_for_status()
-            if kwargs.get("stream"):
-                # The completions streaming API returns data in server-sent
-                # events format. We only need to capture the last "completion"
-                # event with which is followed by a "done" event with empty data.
-                # Practically this is the last line starting with r'^data: {"'
-                last_response = ""
-                for line in resp.iter_lines(decode_unicode=True):
-                    if line.startswith('data: {"'):
-                        last_response = line[6:]
-                # last_response should look like:
-                # '{"completion": "... some answer ...", "stopReason": "stop"}'
-                data = pd.from_json(last_response)
-                if "completion" not in data:
-                    raise ValueError("Received unexpected API response")
-                return data["completion"]
-            return resp.json()
-        except Exception as exc:
-            self.logger.exception(
-                "Failed during API call: %r - %s", exc, getattr(resp, "text")
-            )
-            raise
+        if stream:
+            return _extract_stream_completion(resp.content)
+        return pd.from_json(resp.content)
+
+    def get_models(self, ttl: float = 300):
+        """Retrieve list of supported LLM models
 
-    def get_models(self):
-        """Retrieve list of supported LLM models"""
-        return self._make_request(method="get", uri="/.api/llm/models")["data"]
+        The list is cached for `ttl` seconds, as the model catalog rarely
+        changes.
+        """
+        models = self._cached_models(ttl)
+        if models is None:
+            result = self._make_request(method="get", uri="/.api/llm/models")
+            models = self._cache_models(result["data"])
+        return models
 
     def chat(
         self,
-        message: str | list[Message],
+        message: str | list[Message | dict],
         model: LLMModels = DEFAULT_LLM,
         max_completion_tokens: int = 4000,
     ):
         """Send Chat message to the new non-streaming LLM API"""
-
-        if isinstance(message, str):
-            messages = [Message(content=message)]
-        else:
-            messages = message
-
-        payload = {
-            "model": model,
-            "messages": messages,
-            "stream": False,
-            "max_tokens": max_completion_tokens,
-        }
+        payload = _build_chat_payload(message, model, max_completion_tokens)
         return self._make_request(
-            method="post", uri="/.api/llm/chat/completions", data=pd.to_json(payload)
+            method="post", uri="/.api/llm/chat/completions", data=payload
         )
 
     def chat_stream(
@@ -199,22 +331,11 @@ class CodyAPIClient:
         max_completion_tokens: int = 4000,
     ) -> str:
         """Send a Chat message using the streaming LLM API"""
-
-        params = {
-            "api-version": 1,
-            "client-name": "codypy",
-            "client-version": "5.7",
-        }
-        payload = {
-            "model": model,
-            "messages": [{"speaker": "human", "text": query}],
-            "maxTokensToSample": max_completion_tokens,
-        }
+        payload = _build_stream_payload(query, model, max_completion_tokens)
         return self._make_request(
             method="post",
-            uri="/.api/completions/stream",
+            uri=_COMPLETIONS_STREAM_URI,
             stream=True,
-            params=params,
             json=payload,
         )
 
@@ -238,22 +359,13 @@ class CodyAPIClient:
         :param text_results_count: Int, The number of results to return
             from text sources like Markdown. Should be between 0 and 100.
         """
-
-        if isinstance(repos, str):
-            repos = [{"name": repos}]
-        else:
-            repos = [{"name": x} for x in repos]
-
-        payload = {
-            "repos": repos,
-            "query": query,
-            "codeResultsCount": code_results_count,
-            "textResultsCount": text_results_count,
-        }
+        payload = _build_context_payload(
+            repos, query, code_results_count, text_results_count
+        )
         return self._make_request(method="post", uri="/.api/cody/context", json=payload)
 
 
-class AsyncCodyAPIClient:
+class AsyncCodyAPIClient(_BaseCodyAPIClient):
     """Async Cody API Client
 
     Usage:
@@ -270,97 +382,125 @@ class AsyncCodyAPIClient:
     # Send a streaming chat message
     >>> stream_response = loop.run_until_complete(client.chat_stream("Tell me a joke"))
     >>> print("Streaming response:", stream_response)
+    # Close the pooled connections once done
+    >>> loop.run_until_complete(client.aclose())
+    # Alternatively use the client as an async context manager
+    >>> async with AsyncCodyAPIClient() as client:
+    ...     response = await client.chat("Hello, Cody!")
+    # Limit how many requests are in flight at once (default: 16)
+    >>> client = AsyncCodyAPIClient(max_concurrency=4)
+    >>> responses = loop.run_until_complete(
+    ...     asyncio.gather(*(client.chat(q) for q in questions))
+    ... )
     """
 
-    def __init__(self, access_token: str = "", server_endpoint: str = ""):
-        self.access_token = access_token or os.getenv("SRC_ACCESS_TOKEN")
-        self.server_endpoint = server_endpoint or os.getenv("SRC_ENDPOINT")
-        if not self.access_token:
-            raise ValueError(
-                "You must either pass 'access_token' explicitly or "
-                "set 'SRC_ACCESS_TOKEN' environment variable."
-            )
-        if not self.server_endpoint:
-            raise ValueError(
-                "You must either pass 'server_endpoint' explicitly "
-                "or set 'SRC_ENDPOINT' environment variable."
+    def __init__(
+        self,
+        access_token: str = "",
+        server_endpoint: str = "",
+        max_concurrency: int = 16,
+    ):
+        super().__init__(access_token, server_endpoint)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Created lazily on first use and reused afterwards, so requests
+        # share pooled keep-alive (and HTTP/2 multiplexed) connections
+        self._client: httpx.AsyncClient | None = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        """Close the underlying HTTP client and its pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Return the shared client, so connections are reused across calls"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=True,
+                base_url=self.server_endpoint,
+                headers=self.headers,
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
             )
-        self.headers = {
-            "Authorization": f"token {self.access_token}",
-            "Content-Type": "application/json",
-            "Accept": "application/json",
-            "User-Agent": "codypy-5.7",
-        }
-        self.logger = logging.getLogger(__name__)
+        return self._client
 
+    @retry(
+        stop=stop_after_attempt(5),
+        wait=wait_exponential_jitter(initial=0.5, max=10),
+        retry=retry_if_exception(_is_retryable),
+        reraise=True,
+    )
     async def _make_request(self, method: str, uri: str, timeout: int = 10, **kwargs):
-        """Make a generic async request"""
-        url = self.server_endpoint + uri
-
-        async with aiohttp.ClientSession(headers=self.headers) as session:
-            try:
-                stream = kwargs.pop("stream", None)
-                async with session.request(
-                    method, url, timeout=timeout, **kwargs
+        """Make a generic async request via the shared client, retrying
+        transient errors with exponential backoff"""
+        client = self._get_client()
+        # Bound the number of requests in flight, so batch workloads don't
+        # open more sockets than the connection pool can keep alive
+        async with self._semaphore:
+            if kwargs.pop("stream", None):
+                async with client.stream(
+                    method, uri, timeout=timeout, **kwargs
                 ) as resp:
-                    resp.raise_for_status()
-                    if stream:
-                        # Handle streaming response
-                        last_response = ""
-                        async for line in resp.content:
-                            line = line.decode("utf-8").strip()
-                            if line.startswith('data: {"'):
-                                last_response = line[6:]
-                        data = pd.from_json(last_response)
-                        if "completion" not in data:
-                            raise ValueError("Received unexpected API response")
-                        return data["completion"]
-                    return await resp.json()
-            except Exception as exc:
-                self.logger.exception(
-                    "Failed during API call: %r - %s", exc, getattr(resp, "text", "")
-                )
-                raise
-
-    async def get_models(self):
-        """Retrieve list of supported LLM models"""
-        result = await self._make_request(method="get", uri="/.api/llm/models")
-        return result["data"]
-
-    async def chat(self, message: str | list[Message], model: LLMModels = DEFAULT_LLM):
+                    if resp.is_error:
+                        await resp.aread()
+                        self._log_failed_response(method, uri, resp)
+                        resp.raise_for_status()
+                    # Only buffer from the start of the last data line
+                    # received so far
+                    body = b""
+                    async for chunk in resp.aiter_bytes():
+                        body += chunk
+                        start = body.rfind(b'\ndata: {"')
+                        if start > 0:
+                            body = body[start:]
+                return _extract_stream_completion(body)
+            resp = await client.request(method, uri, timeout=timeout, **kwargs)
+            if resp.is_error:
+                self._log_failed_response(method, uri, resp)
+                resp.raise_for_status()
+            return pd.from_json(resp.content)
+
+    async def get_models(self, ttl: float = 300):
+        """Retrieve list of supported LLM models
+
+        The list is cached for `ttl` seconds, as the model catalog rarely
+        changes.
+        """
+        models = self._cached_models(ttl)
+        if models is None:
+            result = await self._make_request(method="get", uri="/.api/llm/models")
+            models = self._cache_models(result["data"])
+        return models
+
+    async def chat(
+        self,
+        message: str | list[Message | dict],
+        model: LLMModels = DEFAULT_LLM,
+        max_completion_tokens: int = 4000,
+    ):
         """Send Chat message to the new non-streaming LLM API"""
-        if isinstance(message, str):
-            messages = [Message(content=message)]
-        else:
-            messages = message
-
-        payload = {
-            "model": model,
-            "messages": messages,
-            "stream": False,
-            "max_tokens": 4000,
-        }
+        payload = _build_chat_payload(message, model, max_completion_tokens)
         return await self._make_request(
-            method="post", uri="/.api/llm/chat/completions", data=pd.to_json(payload)
+            method="post", uri="/.api/llm/chat/completions", content=payload
         )
 
-    async def chat_stream(self, query: str, model: LLMModels = DEFAULT_LLM) -> str:
+    async def chat_stream(
+        self,
+        query: str,
+        model: LLMModels = DEFAULT_LLM,
+        max_completion_tokens: int = 4000,
+    ) -> str:
         """Send a Chat message using the streaming LLM API"""
-        params = {
-            "api-version": 1,
-            "client-name": "codypy",
-            "client-version": "5.7",
-        }
-        payload = {
-            "model": model,
-            "messages": [{"speaker": "human", "text": query}],
-            "maxTokensToSample": 4000,
-        }
+        payload = _build_stream_payload(query, model, max_completion_tokens)
         return await self._make_request(
             method="post",
-            uri="/.api/completions/stream",
+            uri=_COMPLETIONS_STREAM_URI,
             stream=True,
-            params=params,
             json=payload,
         )
 
@@ -384,18 +524,9 @@ class AsyncCodyAPIClient:
         :param text_results_count: Int, The number of results to return
             from text sources like Markdown. Should be between 0 and 100.
         """
-
-        if isinstance(repos, str):
-            repos = [{"name": repos}]
-        else:
-            repos = [{"name": x} for x in repos]
-
-        payload = {
-            "repos": repos,
-            "query": query,
-            "codeResultsCount": code_results_count,
-            "textResultsCount": text_results_count,
-        }
+        payload = _build_context_payload(
+            repos, query, code_results_count, text_results_count
+        )
         return await self._make_request(
             method="post", uri="/.api/cody/context", json=payload
         )
@@ -442,39 +573,38 @@ def test_sync():
 
 async def test_async():
     """Testing asynchronous code"""
-    api = AsyncCodyAPIClient()
-
-    # Testing models
-    models = await api.get_models()
-    assert isinstance(models, list)
-    assert isinstance(models[0], dict)
-    assert DEFAULT_LLM in {x["id"] for x in models}
-
-    # Testing streaming chat
-    q = "Today is Monday. Reply the day of tomorrow without punctiation."
-    resp = await api.chat_stream(q)
-    assert resp == "Tuesday"
+    async with AsyncCodyAPIClient() as api:
+        # The calls are independent, so run them all concurrently
+        monday = "Today is Monday. Reply the day of tomorrow without punctiation."
+        friday = "Today is Friday. Reply the day of tomorrow without punctiation."
+        models, stream1, stream2, chat1, chat2, context = await asyncio.gather(
+            api.get_models(),
+            api.chat_stream(monday),
+            api.chat_stream(friday, model="openai::2024-02-01::gpt-4o"),
+            api.chat(monday),
+            api.chat(friday, model="openai::2024-02-01::gpt-4o"),
+            api.get_context(
+                repos="gitlab.com/oriordan/codypy",
+                query="What is this repo about?",
+            ),
+        )
 
-    q = "Today is Friday. Reply the day of tomorrow without punctiation."
-    resp = await api.chat_stream(q, model="openai::2024-02-01::gpt-4o")
-    assert resp == "Saturday"
+        # Testing models
+        assert isinstance(models, list)
+        assert isinstance(models[0], dict)
+        assert DEFAULT_LLM in {x["id"] for x in models}
 
-    # Testing non-streaming chat
-    q = "Today is Monday. Reply the day of tomorrow without punctiation."
-    resp = await api.chat(q)
-    assert resp["choices"][0]["message"]["content"] == "Tuesday"
+        # Testing streaming chat
+        assert stream1 == "Tuesday"
+        assert stream2 == "Saturday"
 
-    q = "Today is Friday. Reply the day of tomorrow without punctiation."
-    resp = await api.chat(q, model="openai::2024-02-01::gpt-4o")
-    assert resp["choices"][0]["message"]["content"] == "Saturday"
+        # Testing non-streaming chat
+        assert chat1["choices"][0]["message"]["content"] == "Tuesday"
+        assert chat2["choices"][0]["message"]["content"] == "Saturday"
 
-    # Testing repo context
-    resp = await api.get_context(
-        repos="gitlab.com/oriordan/codypy",
-        query="What is this repo about?",
-    )
-    assert isinstance(resp, dict)
-    assert len(resp["results"]) > 15
+        # Testing repo context
+        assert isinstance(context, dict)
+        assert len(context["results"]) > 15
 
     print("All async tests passed!")
 